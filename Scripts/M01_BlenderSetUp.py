@@ -57,7 +57,8 @@ def delAllCams():
 
 
 
-def enable_gpus(device_type, use_cpus=False):
+def enable_gpus(device_type, use_cpus=False, use_persistent_data=True, tile_size=None,
+                use_spatial_splits=None):
     preferences = bpy.context.preferences
     cycles_preferences = preferences.addons["cycles"].preferences
     cuda_devices, opencl_devices = cycles_preferences.get_devices()
@@ -82,6 +83,16 @@ def enable_gpus(device_type, use_cpus=False):
     cycles_preferences.compute_device_type = device_type
     bpy.context.scene.cycles.device = "GPU"
 
+    # keep the synced scene (BVH, shaders) alive between consecutive renders
+    bpy.context.scene.render.use_persistent_data = use_persistent_data
+    # spatial splits make every BVH (re)build much slower, pass False when geometry changes between renders
+    if use_spatial_splits is not None:
+        bpy.context.scene.cycles.debug_use_spatial_splits = use_spatial_splits
+    # GPUs prefer few large tiles, only override the scene's tiles when asked to
+    if tile_size is not None:
+        bpy.context.scene.render.tile_x = tile_size
+        bpy.context.scene.render.tile_y = tile_size
+
     return activated_gpus
 
 
@@ -1,5 +1,5 @@
 import os
-import glob
+import bisect
 import sys
 import bpy
 import mathutils
@@ -10,6 +10,7 @@ from os.path import join
 from pathlib import Path
 import time
 import copy
+import numpy as np
 
 pi = 3.14159265358979
 
@@ -22,10 +23,19 @@ exampleObjList = [
         "scaling": [0, 0, 0],
         "texture": "textureName",
         "smoothedRendering": True,
+        # optional, only used with BWrapper.reuseImports
+        "name": None,
+        "vertices": None,
     },
 ]
 
 
+def checkShard(shardId, numShards):
+    if not 0 <= shardId < numShards:
+        raise ValueError("Invalid shard: shardId must be in [0, numShards), got shardId={}, numShards={}"
+                         .format(shardId, numShards))
+
+
 class BWrapper:
     def __init__(s):
         s.cameraRotation = None
@@ -39,29 +49,83 @@ class BWrapper:
         s.globalAutoSmooth = False
         s.globalSubdiv = False
         s.globalSubdivLvl = 1
+        # keep imported objects in the scene between renderObjects calls, one cache entry per objInfo['name']
+        # (or per slot in objectList when no name is given): the same path is reused as is, objInfo['vertices']
+        # overwrites the coordinates of the cached mesh, any other path replaces the cached import
+        s.reuseImports = False
+        s.importCache = {}
 
         s.fileId = 0
+        # first <filePrefix><index> frame not found yet, the next wake of batchedRendering probes from there
+        s.nextProbeId = 0
         s.fps = 60
 
     def renderObjects(s, objectList, outPath, ):
-
-        for objInfo in objectList:
-            print("Importing: ", objInfo['path'])
-
-            # adjust camera focus
-            cam_ob = bpy.context.scene.camera
-            _, inModelExt = os.path.splitext(objInfo['path'])
-
-            print("Importing ", inModelExt, " file.")
-            if inModelExt == '.ply':
-                bpy.ops.import_mesh.ply(filepath=objInfo['path'])
-            elif inModelExt == '.obj':
-                bpy.ops.import_scene.obj(filepath=objInfo['path'], )
+        importedThisCall = []
+        usedKeys = set()
+
+        for iObj, objInfo in enumerate(objectList):
+            stem = Path(objInfo['path']).stem
+            inPath = os.path.abspath(objInfo['path'])
+            verts = objInfo.get("vertices", None)
+
+            cacheKey = objInfo.get("name", None)
+            if cacheKey is None:
+                cacheKey = iObj
+            if cacheKey in usedKeys:
+                raise ValueError("renderObjects: name used twice in objectList: " + str(cacheKey))
+            usedKeys.add(cacheKey)
+
+            cached = s.importCache.get(cacheKey, None) if s.reuseImports else None
+            if cached is not None and cached["path"] != inPath and verts is None:
+                # a different file in this slot, its topology may differ from the cached one
+                s.deleteObjects(cached["objs"])
+                del s.importCache[cacheKey]
+                cached = None
+
+            if cached is not None:
+                print("Reusing: ", objInfo['path'])
+                obj = cached["obj"]
+                for cachedObj in cached["objs"]:
+                    cachedObj.hide_render = False
+                # undo what the previous call applied so objInfo acts on the object as it was imported
+                s.restoreImportState(obj, cached["state"])
             else:
-                Exception()
+                print("Importing: ", objInfo['path'])
+
+                # adjust camera focus
+                cam_ob = bpy.context.scene.camera
+                _, inModelExt = os.path.splitext(objInfo['path'])
+
+                print("Importing ", inModelExt, " file.")
+                for selected in bpy.context.selected_objects:
+                    selected.select_set(state=False)
+                if inModelExt == '.ply':
+                    bpy.ops.import_mesh.ply(filepath=objInfo['path'])
+                elif inModelExt == '.obj':
+                    bpy.ops.import_scene.obj(filepath=objInfo['path'], )
+                else:
+                    Exception()
+
+                # the importer leaves only the new objects selected, no need to scan the whole scene for them
+                newObjs = list(bpy.context.selected_objects)
+                stemObjs = [newObj for newObj in newObjs if s.checkNameByPrefix(newObj, stem)]
+                if len(stemObjs):
+                    obj = stemObjs[0]
+                elif len(newObjs):
+                    obj = newObjs[0]
+                else:
+                    obj = s.selectObjByPrefix(stem)
+                    newObjs = [obj]
+                # an obj file can hold several objects, all of them have to be cleaned up
+                importedThisCall.extend(newObjs)
+
+                if s.reuseImports:
+                    s.importCache[cacheKey] = {"path": inPath, "objs": newObjs, "obj": obj,
+                                               "state": s.getImportState(obj)}
 
-            bpy.ops.object.select_all(action='DESELECT')
-            obj = s.selectObjByPrefix(Path(objInfo['path']).stem)
+            if verts is not None:
+                s.setMeshVertices(obj.data, verts)
 
             for i in range(3):
                 if objInfo.get("rotation", None) and objInfo['rotation'][i] is not None:
@@ -77,21 +141,24 @@ class BWrapper:
                     obj.data.use_auto_smooth = True
                     obj.data.auto_smooth_angle = math.radians(180)
                     mesh = obj.data
-                    for f in mesh.polygons:
-                        f.use_smooth = True
+                    mesh.polygons.foreach_set('use_smooth', np.ones(len(mesh.polygons), dtype=bool))
             elif s.globalAutoSmooth:
                 obj.data.use_auto_smooth = True
                 obj.data.auto_smooth_angle = math.radians(180)
                 mesh = obj.data
-                for f in mesh.polygons:
-                    f.use_smooth = True
+                mesh.polygons.foreach_set('use_smooth', np.ones(len(mesh.polygons), dtype=bool))
 
             # subdivide surface
+            subdivMods = [mod for mod in obj.modifiers if mod.name == 'My SubDiv']
             if s.globalSubdiv:
-                obj.modifiers.new('My SubDiv', 'SUBSURF')
+                if not len(subdivMods):
+                    obj.modifiers.new('My SubDiv', 'SUBSURF')
                 for mod in obj.modifiers:
                     if mod.type == 'SUBSURF':
                         mod.levels = s.globalSubdiv
+            else:
+                for mod in subdivMods:
+                    obj.modifiers.remove(mod)
 
             mat = bpy.data.materials.get(objInfo['texture'])
 
@@ -104,22 +171,58 @@ class BWrapper:
 
             obj.data.materials[0] = mat
 
+        # cached objects not listed in this call must not show up in the render
+        for key, cached in s.importCache.items():
+            if key not in usedKeys:
+                for cachedObj in cached["objs"]:
+                    cachedObj.hide_render = True
+
         bpy.context.scene.render.filepath = outPath
         bpy.ops.render.render(write_still=True)
 
-        for objInfo in objectList:
-            bpy.ops.object.select_all(action='DESELECT')
-            obj = s.selectObjByPrefix(Path(objInfo['path']).stem)
-            bpy.ops.object.delete()
-
-        for block in bpy.data.meshes:
-            # print("block:", block.name)
-            for objInfo in objectList:
-                if block.users == 0 and s.checkNameByPrefix(block, Path(objInfo['path']).stem):
-                    # print("Matched, deleting: ", block.name)
-                    bpy.data.meshes.remove(block)
-
-                    break
+        if not s.reuseImports:
+            s.deleteObjects(importedThisCall)
+
+    def getImportState(s, obj):
+        mesh = obj.data
+        useSmooth = np.empty(len(mesh.polygons), dtype=bool)
+        mesh.polygons.foreach_get('use_smooth', useSmooth)
+        return {
+            "matrixWorld": obj.matrix_world.copy(),
+            "useAutoSmooth": mesh.use_auto_smooth,
+            "autoSmoothAngle": mesh.auto_smooth_angle,
+            "useSmooth": useSmooth,
+        }
+
+    def restoreImportState(s, obj, state):
+        obj.matrix_world = state["matrixWorld"]
+        mesh = obj.data
+        mesh.use_auto_smooth = state["useAutoSmooth"]
+        mesh.auto_smooth_angle = state["autoSmoothAngle"]
+        mesh.polygons.foreach_set('use_smooth', state["useSmooth"])
+
+    def updateVertices(s, name, verts):
+        # fast path for fixed topology sequences: overwrite the coordinates of a cached import outside renderObjects
+        if name not in s.importCache:
+            raise RuntimeError("updateVertices: no imported object cached under " + str(name)
+                               + ", set reuseImports = True and render it with renderObjects first")
+        s.setMeshVertices(s.importCache[name]["obj"].data, verts)
+
+    def setMeshVertices(s, mesh, verts):
+        mesh.vertices.foreach_set('co', np.ascontiguousarray(verts, dtype=np.float32).reshape(-1))
+        mesh.update()
+
+    def clearImportedObjects(s):
+        for cached in s.importCache.values():
+            s.deleteObjects(cached["objs"])
+        s.importCache = {}
+
+    def deleteObjects(s, objs):
+        for obj in objs:
+            mesh = obj.data
+            bpy.data.objects.remove(obj, do_unlink=True)
+            if mesh is not None and mesh.users == 0:
+                bpy.data.meshes.remove(mesh)
 
     def batchedRendering(s, inFolder, numFrames, outPath=None, cam_name="Camera", inModelExt="ply", filePrefix="A0"):
         bpy.context.scene.camera = bpy.context.scene.objects[cam_name]
@@ -135,7 +238,12 @@ class BWrapper:
         subdivLvl = 1
         doSubDiv = False
 
-        inModelFiles = sorted(glob.glob(join(inFolder, "*." + inModelExt)))
+        # frames named <filePrefix><index>.<ext> are probed directly, a gap in the numbering or
+        # differently named files fall back to one scan of the folder
+        inModelFiles = s.listFrameFiles(inFolder, inModelExt, filePrefix, 0, numFrames)
+        s.nextProbeId = len(inModelFiles)
+        if len(inModelFiles) < numFrames:
+            inModelFiles = sorted(inModelFiles + s.listNewFiles(inFolder, inModelExt, inModelFiles))
 
         print("Number of Frames:", len(inModelFiles))
 
@@ -149,13 +257,42 @@ class BWrapper:
                 print("No more frames to render! Wait for 6 mins.")
                 if s.waitForNewFrames:
                     time.sleep(60)
-                    inModelFiles = sorted(glob.glob(join(inFolder, "*." + inModelExt)))
+                    # keep the list sorted so that fileId still indexes the frames in order
+                    for file in s.findNewFrames(inFolder, inModelExt, filePrefix, inModelFiles, numFrames):
+                        bisect.insort(inModelFiles, file)
                     continue
                 else:
                     break
         s.fileId = s.fileId + s.renderStride
         file = inModelFiles[s.fileId]
 
+    def findNewFrames(s, inFolder, inModelExt, filePrefix, knownFiles, numFrames):
+        # probe the numbered frames from the first one not found yet, scan the folder only when that finds nothing new
+        known = set(knownFiles)
+        probedFiles = s.listFrameFiles(inFolder, inModelExt, filePrefix, s.nextProbeId, numFrames)
+        s.nextProbeId += len(probedFiles)
+        # frames past a gap may already be known from an earlier scan
+        newFiles = [file for file in probedFiles if file not in known]
+        if len(newFiles):
+            return newFiles
+        return s.listNewFiles(inFolder, inModelExt, knownFiles)
+
+    def listFrameFiles(s, inFolder, inModelExt, filePrefix, start, numFrames):
+        frameFiles = []
+        for i in range(start, numFrames):
+            file = join(inFolder, "{}{:06d}.{}".format(filePrefix, i, inModelExt))
+            if not os.path.exists(file):
+                break
+            frameFiles.append(file)
+        return frameFiles
+
+    def listNewFiles(s, inFolder, inModelExt, knownFiles):
+        # only sort what showed up since the last scan instead of re-globbing the whole folder
+        known = set(knownFiles)
+        newFiles = [join(inFolder, entry.name) for entry in os.scandir(inFolder)
+                    if entry.name.endswith("." + inModelExt) and join(inFolder, entry.name) not in known]
+        return sorted(newFiles)
+
     def rotSceneCamera(s, camObj, rotAngle):
         camObj.camera.location.x = s.cameraRotation.radius * math.cos(
             math.radians(rotAngle)) + s.cameraRotation.centerX
@@ -220,14 +357,16 @@ class ObjectTransformation:
         s.lenEnd = 35
 
 
-def renderImages(camNamesSelected, fileName, output_path):
+def renderImages(camNamesSelected, fileName, output_path, shardId=0, numShards=1):
     # output_path = r'/mnt/willow/Users/Anka/Blender/Output/'
 
+    checkShard(shardId, numShards)
     os.makedirs(output_path, exist_ok=True)
 
     # camSelected = range(0, 16, )
 
-    for cam_idx in camNamesSelected:
+    # split the cameras across parallel Blender processes, e.g. one per GPU
+    for cam_idx in list(camNamesSelected)[shardId::numShards]:
         # cam_name = "Cam.{:03d}".format(cam_idx)
         # cam_name_out = camNames[cam_idx]
         # cam_name = "Cam.{:03d}".format(cam_idx)
@@ -239,8 +378,11 @@ def renderImages(camNamesSelected, fileName, output_path):
         bpy.ops.render.render(write_still=True)
 
 
-def renderAllCameras(outPath, camSpecs=None, filePreFix=''):
+def renderAllCameras(outPath, camSpecs=None, filePreFix='', shardId=0, numShards=1):
+    checkShard(shardId, numShards)
     for iCam, c in enumerate([obj for obj in bpy.data.objects if obj.type == 'CAMERA']):
+        if iCam % numShards != shardId:
+            continue
         print("Rendering:", c.name)
         bpy.context.scene.camera = c
 